@@ -3,49 +3,254 @@ Example script to read and analyze scraped Danbooru posts.
 Demonstrates memory-efficient processing of JSONL files.
 """
 
-import json
+import io
+import itertools
+import mmap
+import multiprocessing
+import os
 from collections import Counter
 from datetime import datetime
 
+import orjson
+import zstandard as zstd
 
-def count_posts(filename="danbooru_posts.jsonl"):
-    """Count total number of posts in the file."""
-    count = 0
-    with open(filename, 'r', encoding='utf-8') as f:
-        for _ in f:
+from config import INDEX_ENTRY, INDEX_ID
+
+# Smallest byte range worth handing to a separate worker process
+MIN_SHARD_SIZE = 32 << 20
+
+# Escape character in serialized JSON strings
+BACKSLASH = ord('\\')
+
+# Length of the YYYY-MM-DD prefix of an ISO-8601 `created_at` timestamp
+DATE_WIDTH = 10
+
+
+def open_jsonl(path):
+    """
+    Open a JSONL file for binary reading.
+    Files ending in `.zst` are decompressed on the fly.
+    """
+    if path.endswith('.zst'):
+        reader = zstd.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True)
+        return io.BufferedReader(reader, buffer_size=1 << 20)
+    return open(path, 'rb')
+
+
+def iter_jsonl_lines(path, bufsize=1 << 20, start=0, end=None):
+    """
+    Yield raw lines (as bytes, without the newline) from a JSONL file.
+    Reads the file in large binary chunks instead of iterating text lines.
+    
+    If `start`/`end` byte offsets are given, only lines beginning inside
+    [start, end) are yielded, so adjacent ranges cover every line exactly once.
+    Byte ranges aren't supported for compressed (`.zst`) files.
+    """
+    tail = b''
+    pos = 0  # File offset of the first byte in `tail`
+    with open_jsonl(path) as f:
+        if start:
+            # Skip the line we landed in; it belongs to the previous range
+            f.seek(start - 1)
+            pos = start - 1
+            while True:
+                buf = f.read(bufsize)
+                if not buf:
+                    return
+                i = buf.find(b'\n')
+                if i >= 0:
+                    pos += i + 1
+                    f.seek(pos)
+                    break
+                pos += len(buf)
+        
+        while True:
+            buf = f.read(bufsize)
+            if not buf:
+                break
+            lines = (tail + buf).split(b'\n')
+            tail = lines.pop()
+            for line in lines:
+                if end is not None and pos >= end:
+                    return
+                pos += len(line) + 1
+                if line:
+                    yield line
+    if tail.strip() and (end is None or pos < end):
+        yield tail
+
+
+def count_posts(filename="danbooru_posts.jsonl", chunk_size=16 << 20):
+    """Count total number of posts in the file by counting newlines."""
+    if filename.endswith('.zst'):
+        # Compressed files can't be mapped; count newlines while streaming
+        count = 0
+        last = b'\n'
+        with open_jsonl(filename) as f:
+            for buf in iter(lambda: f.read(chunk_size), b''):
+                count += buf.count(b'\n')
+                last = buf[-1:]
+        # Last line without a trailing newline
+        if last != b'\n':
             count += 1
+        return count
+    
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            count = sum(mm[i:i + chunk_size].count(b'\n') for i in range(0, size, chunk_size))
+            # Last line without a trailing newline
+            if mm[size - 1:size] != b'\n':
+                count += 1
     return count
 
 
+def _find_post_in_index(post_id, filename):
+    """
+    Look a post up through the scraper's sorted ID index (`.idx` next to an
+    uncompressed JSONL file): binary search the index, then read one line.
+    
+    Returns:
+        (indexed, post): `indexed` is False if there's no index, it isn't
+        sorted, or it leads to the wrong line; otherwise `post` is the post,
+        or None if the ID isn't in the file
+    """
+    index_file = os.path.splitext(filename)[0] + '.idx'
+    if filename.endswith('.zst') or not os.path.exists(index_file):
+        return False, None
+    
+    with open(index_file, 'rb') as f:
+        entries = os.fstat(f.fileno()).st_size // INDEX_ENTRY.size
+        if entries == 0:
+            return False, None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            def id_at(i):
+                return INDEX_ID.unpack_from(mm, i * INDEX_ENTRY.size)[0]
+            
+            lo, hi = 0, entries
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if id_at(mid) < post_id:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            
+            # An index left unsorted by an interrupted scraper run can't be
+            # binary searched; spot-check the order around the result
+            if (id_at(0) > id_at(entries - 1)
+                    or (lo > 0 and lo < entries and id_at(lo - 1) > id_at(lo))
+                    or (lo + 1 < entries and id_at(lo + 1) < id_at(lo))):
+                return False, None
+            if lo == entries or id_at(lo) != post_id:
+                return True, None
+            offset = INDEX_ENTRY.unpack_from(mm, lo * INDEX_ENTRY.size)[1]
+    
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        line = f.readline()
+    try:
+        post = orjson.loads(line)
+    except orjson.JSONDecodeError:
+        return False, None
+    if not isinstance(post, dict) or post.get('id') != post_id:
+        return False, None
+    return True, post
+
+
 def get_post_by_id(post_id, filename="danbooru_posts.jsonl"):
-    """Find and return a specific post by ID."""
-    with open(filename, 'r', encoding='utf-8') as f:
-        for line in f:
-            post = json.loads(line)
-            if post['id'] == post_id:
-                return post
+    """
+    Find and return a specific post by ID.
+    Uses the scraper's ID index when available; otherwise (or if the index is
+    unsorted or stale) scans the whole file.
+    """
+    indexed, post = _find_post_in_index(post_id, filename)
+    if indexed:
+        return post
+    
+    for line in iter_jsonl_lines(filename):
+        post = orjson.loads(line)
+        if post['id'] == post_id:
+            return post
     return None
 
 
+def _extract_field_bytes(line, key):
+    """
+    Return the raw value of field `key` from a serialized post without decoding
+    the line: the bytes between the quotes for strings (escapes left as-is) or
+    the literal for numbers. Returns None if the field is missing or null.
+    
+    Only the first occurrence is used; Danbooru lists a post's own fields before
+    nested objects such as `media_asset`, so that's the top-level field.
+    """
+    pattern = b'"' + key + b'":'
+    i = line.find(pattern)
+    if i < 0:
+        return None
+    i += len(pattern)
+    while line[i:i + 1] == b' ':
+        i += 1
+    
+    if line[i:i + 1] == b'"':
+        end = line.find(b'"', i + 1)
+        # Skip quotes escaped by an odd number of backslashes
+        while end > 0 and line[end - 1] == BACKSLASH:
+            first = end - 1
+            while line[first - 1] == BACKSLASH:
+                first -= 1
+            if (end - first) % 2 == 0:
+                break
+            end = line.find(b'"', end + 1)
+        return line[i + 1:end] if end > 0 else None
+    
+    end = i
+    while end < len(line) and line[end] not in b',}] \t\r':
+        end += 1
+    value = line[i:end]
+    return None if value in (b'', b'null') else value
+
+
+def _iter_post_tags(post):
+    """Iterate over all tags of a post."""
+    if 'tag_string' in post:
+        return post['tag_string'].split()
+    # Fallback: chain individual tag categories without building a combined list
+    return itertools.chain(
+        post.get('tag_string_general', '').split(),
+        post.get('tag_string_character', '').split(),
+        post.get('tag_string_copyright', '').split(),
+        post.get('tag_string_artist', '').split(),
+        post.get('tag_string_meta', '').split(),
+    )
+
+
 def analyze_file_ratings(filename="danbooru_posts.jsonl", sample_size=None):
     """Analyze the distribution of post ratings."""
     rating_counter = Counter()
     count = 0
     
-    with open(filename, 'r', encoding='utf-8') as f:
-        for line in f:
-            post = json.loads(line)
-            rating = post.get('rating', 'unknown')
-            rating_counter[rating] += 1
-            count += 1
-            
-            if sample_size and count >= sample_size:
-                break
+    # Ratings are short plain strings, so they're read straight from the raw
+    # line bytes; keys stay bytes until the report is printed
+    for line in iter_jsonl_lines(filename):
+        rating_counter[_extract_field_bytes(line, b'rating') or b'unknown'] += 1
+        count += 1
+        
+        if sample_size and count >= sample_size:
+            break
     
+    rating_counter = Counter({rating.decode('utf-8'): n for rating, n in rating_counter.items()})
+    _print_rating_distribution(rating_counter, count)
+
+
+def _print_rating_distribution(rating_counter, count):
+    """Print a rating histogram collected from `count` posts."""
     print(f"\nRating Distribution (from {count} posts):")
     print("-" * 40)
+    total = sum(rating_counter.values())
     for rating, count in rating_counter.most_common():
-        percentage = (count / sum(rating_counter.values())) * 100
+        percentage = (count / total) * 100
         print(f"{rating}: {count} ({percentage:.2f}%)")
 
 
@@ -54,59 +259,65 @@ def get_top_tags(filename="danbooru_posts.jsonl", top_n=20, sample_size=None):
     tag_counter = Counter()
     count = 0
     
-    with open(filename, 'r', encoding='utf-8') as f:
-        for line in f:
-            post = json.loads(line)
-            
-            # Combine all tag types
-            all_tags = []
-            if 'tag_string' in post:
-                all_tags = post['tag_string'].split()
-            else:
-                # Fallback: combine individual tag categories
-                all_tags.extend(post.get('tag_string_general', '').split())
-                all_tags.extend(post.get('tag_string_character', '').split())
-                all_tags.extend(post.get('tag_string_copyright', '').split())
-                all_tags.extend(post.get('tag_string_artist', '').split())
-                all_tags.extend(post.get('tag_string_meta', '').split())
-            
-            tag_counter.update(all_tags)
-            count += 1
-            
-            if sample_size and count >= sample_size:
-                break
+    for line in iter_jsonl_lines(filename):
+        post = orjson.loads(line)
+        
+        tag_counter.update(_iter_post_tags(post))
+        count += 1
+        
+        if sample_size and count >= sample_size:
+            break
     
+    _print_top_tags(tag_counter, count, top_n)
+
+
+def _print_top_tags(tag_counter, count, top_n):
+    """Print the `top_n` most common tags collected from `count` posts."""
     print(f"\nTop {top_n} Tags (from {count} posts):")
     print("-" * 40)
     for tag, count in tag_counter.most_common(top_n):
         print(f"{tag}: {count}")
 
 
+def _tag_string_window(line):
+    """
+    Return the raw `tag_string` value of a JSONL line padded with spaces,
+    or None if it can't be located without parsing the line.
+    """
+    value = _extract_field_bytes(line, b'tag_string')
+    # Escaped characters (including quotes) need a real JSON decode
+    if value is None or b'\\' in value:
+        return None
+    return b' ' + value + b' '
+
+
 def filter_posts_by_tags(tags, filename="danbooru_posts.jsonl", output_file="filtered_posts.jsonl"):
     """Filter posts that contain ALL specified tags."""
     tags_set = set(tags)
     matched_count = 0
     
-    with open(filename, 'r', encoding='utf-8') as infile:
-        with open(output_file, 'w', encoding='utf-8') as outfile:
-            for line in infile:
-                post = json.loads(line)
-                
-                # Get all tags from the post
-                post_tags = set()
-                if 'tag_string' in post:
-                    post_tags = set(post['tag_string'].split())
-                else:
-                    post_tags.update(post.get('tag_string_general', '').split())
-                    post_tags.update(post.get('tag_string_character', '').split())
-                    post_tags.update(post.get('tag_string_copyright', '').split())
-                    post_tags.update(post.get('tag_string_artist', '').split())
-                    post_tags.update(post.get('tag_string_meta', '').split())
-                
-                # Check if all required tags are present
-                if tags_set.issubset(post_tags):
-                    outfile.write(line)
-                    matched_count += 1
+    # Lines whose raw tag_string lacks any tag are skipped without a JSON decode.
+    # Tags that would be escaped in JSON can't be matched on raw bytes.
+    needles = None
+    if not any('"' in tag or '\\' in tag for tag in tags_set):
+        needles = [b' ' + tag.encode('utf-8') + b' ' for tag in tags_set]
+    
+    with open(output_file, 'wb') as outfile:
+        for line in iter_jsonl_lines(filename):
+            if needles is not None:
+                window = _tag_string_window(line)
+                if window is not None and not all(needle in window for needle in needles):
+                    continue
+            
+            post = orjson.loads(line)
+            
+            # Get all tags from the post
+            post_tags = set(_iter_post_tags(post))
+            
+            # Check if all required tags are present
+            if tags_set.issubset(post_tags):
+                outfile.write(line + b'\n')
+                matched_count += 1
     
     print(f"\nFiltered {matched_count} posts with tags: {tags}")
     print(f"Saved to: {output_file}")
@@ -114,42 +325,170 @@ def filter_posts_by_tags(tags, filename="danbooru_posts.jsonl", output_file="fil
 
 def get_date_range(filename="danbooru_posts.jsonl"):
     """Get the date range of posts in the file."""
-    dates = []
+    lo = hi = None
+    count = 0
     
-    with open(filename, 'r', encoding='utf-8') as f:
-        for line in f:
-            post = json.loads(line)
-            created_at = post.get('created_at')
-            if created_at:
-                dates.append(created_at)
+    for line in iter_jsonl_lines(filename):
+        created_at = _extract_field_bytes(line, b'created_at')
+        if created_at:
+            # ISO-8601 strings sort chronologically, no datetime parsing needed;
+            # the fixed-width YYYY-MM-DD prefix is all the report shows
+            day = created_at[:DATE_WIDTH]
+            if lo is None:
+                lo = hi = day
+            elif day < lo:
+                lo = day
+            elif day > hi:
+                hi = day
+            count += 1
     
-    if dates:
-        print(f"\nDate Range:")
-        print("-" * 40)
-        print(f"Earliest: {min(dates)}")
-        print(f"Latest: {max(dates)}")
-        print(f"Total posts: {len(dates)}")
+    if count:
+        _print_date_range(lo.decode('utf-8'), hi.decode('utf-8'), count)
+
+
+def _print_date_range(earliest, latest, count):
+    """Print the earliest and latest post dates."""
+    print(f"\nDate Range:")
+    print("-" * 40)
+    print(f"Earliest: {earliest}")
+    print(f"Latest: {latest}")
+    print(f"Total posts: {count}")
+
+
+def _analyze_shard(path, start, end, sample_size=None):
+    """
+    Collect post count, rating, tag and date statistics for the lines that
+    begin inside the byte range [start, end) of a JSONL file.
+    Ratings and tags are collected from the first `sample_size` posts only;
+    past the sample, lines are no longer decoded.
+    
+    Returns:
+        Tuple of (count, sampled, rating_counter, tag_counter, dated,
+        min_date, max_date)
+    """
+    count = 0
+    sampled = 0
+    rating_counter = Counter()
+    tag_counter = Counter()
+    dated = 0
+    min_date = max_date = None
+    
+    for line in iter_jsonl_lines(path, start=start, end=end):
+        count += 1
+        
+        if not sample_size or sampled < sample_size:
+            post = orjson.loads(line)
+            rating_counter[post.get('rating') or 'unknown'] += 1
+            tag_counter.update(_iter_post_tags(post))
+            sampled += 1
+        
+        created_at = _extract_field_bytes(line, b'created_at')
+        if created_at:
+            day = created_at[:DATE_WIDTH]
+            if min_date is None:
+                min_date = max_date = day
+            elif day < min_date:
+                min_date = day
+            elif day > max_date:
+                max_date = day
+            dated += 1
+    
+    return count, sampled, rating_counter, tag_counter, dated, min_date, max_date
+
+
+def _analyze_shard_args(args):
+    """Run _analyze_shard on an argument tuple (for Pool.imap_unordered)."""
+    return _analyze_shard(*args)
+
+
+def _merge_shard_results(results):
+    """Combine `_analyze_shard` results into totals for the whole file."""
+    total_count = 0
+    sampled = 0
+    rating_counter = Counter()
+    tag_counter = Counter()
+    dated = 0
+    min_date = max_date = None
+    for count, shard_sampled, ratings, tags, shard_dated, lo, hi in results:
+        total_count += count
+        sampled += shard_sampled
+        # In-place merges, no intermediate Counter per shard
+        rating_counter += ratings
+        tag_counter += tags
+        dated += shard_dated
+        if lo is not None:
+            min_date = lo if min_date is None else min(min_date, lo)
+            max_date = hi if max_date is None else max(max_date, hi)
+    return total_count, sampled, rating_counter, tag_counter, dated, min_date, max_date
+
+
+def analyze_all(filename="danbooru_posts.jsonl", sample_size=None, top_n=20, processes=None):
+    """
+    Run the post count, rating, tag and date range reports in a single pass.
+    
+    The file is split into byte ranges that are analyzed in parallel worker
+    processes. Ratings and tags are collected from about `sample_size` posts
+    spread evenly over the ranges; the count and date range always cover
+    the whole file. Compressed (`.zst`) files are analyzed in one process.
+    
+    Args:
+        filename: Path to the JSONL file
+        sample_size: Number of posts to collect ratings and tags from (None for all)
+        top_n: Number of tags to report
+        processes: Number of worker processes (default: one per CPU, fewer
+            for small files)
+    """
+    size = os.path.getsize(filename)
+    if filename.endswith('.zst'):
+        processes = 1
+    elif processes is None:
+        processes = min(os.cpu_count() or 1, size // MIN_SHARD_SIZE) or 1
+    shard_sample = -(-sample_size // processes) if sample_size else None
+    shards = [
+        (filename, i * size // processes, (i + 1) * size // processes, shard_sample)
+        for i in range(processes)
+    ]
+    
+    if processes == 1:
+        merged = _merge_shard_results([_analyze_shard(filename, 0, None, sample_size)])
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            # Shards are merged as they finish, while the others are still running
+            merged = _merge_shard_results(pool.imap_unordered(_analyze_shard_args, shards))
+    total_count, sampled, rating_counter, tag_counter, dated, min_date, max_date = merged
+    
+    print(f"\nTotal posts in file: {total_count}")
+    print("\n" + "=" * 50)
+    _print_rating_distribution(rating_counter, sampled)
+    print("\n" + "=" * 50)
+    _print_top_tags(tag_counter, sampled, top_n)
+    if dated:
+        print("\n" + "=" * 50)
+        _print_date_range(min_date.decode('utf-8'), max_date.decode('utf-8'), dated)
+    
+    return total_count
 
 
 def show_sample_post(filename="danbooru_posts.jsonl"):
     """Display a sample post to see available fields."""
-    with open(filename, 'r', encoding='utf-8') as f:
-        line = f.readline()
-        if line:
-            post = json.loads(line)
-            print("\nSample Post Structure:")
-            print("-" * 40)
-            print(json.dumps(post, indent=2))
-            print("\nAvailable Fields:")
-            print(", ".join(post.keys()))
+    line = next(iter_jsonl_lines(filename), None)
+    if line:
+        post = orjson.loads(line)
+        print("\nSample Post Structure:")
+        print("-" * 40)
+        print(orjson.dumps(post, option=orjson.OPT_INDENT_2).decode('utf-8'))
+        print("\nAvailable Fields:")
+        print(", ".join(post.keys()))
 
 
 def main():
     """Main function demonstrating various analysis options."""
-    import os
-    
     filename = "danbooru_posts.jsonl"
     
+    # Fall back to the compressed output if that's what the scraper wrote
+    if not os.path.exists(filename) and os.path.exists(filename + ".zst"):
+        filename += ".zst"
+    
     # Check if file exists
     if not os.path.exists(filename):
         print(f"Error: {filename} not found!")
@@ -160,43 +499,19 @@ def main():
     print("Danbooru Post Analysis")
     print("=" * 50)
     
-    # Basic statistics
-    try:
-        total = count_posts(filename)
-        print(f"\nTotal posts in file: {total}")
-    except Exception as e:
-        print(f"Error counting posts: {e}")
-        return
-    
     # Show a sample post structure (first post only)
-    print("\n" + "=" * 50)
     try:
         show_sample_post(filename)
     except Exception as e:
         print(f"Error showing sample: {e}")
     
-    # Analyze ratings (sample first 10,000 posts for speed)
-    print("\n" + "=" * 50)
-    try:
-        analyze_file_ratings(filename, sample_size=10000)
-    except Exception as e:
-        print(f"Error analyzing ratings: {e}")
-    
-    # Get top tags (sample first 10,000 posts for speed)
-    print("\n" + "=" * 50)
-    try:
-        get_top_tags(filename, top_n=20, sample_size=10000)
-    except Exception as e:
-        print(f"Error analyzing tags: {e}")
-    
-    # Get date range
+    # Count posts and get the date range over the whole file; ratings and tags
+    # come from a sample of about 10,000 posts spread across the file
     print("\n" + "=" * 50)
     try:
-        # Note: This reads all dates, could be slow for large files
-        # Consider sampling if file is too large
-        get_date_range(filename)
+        analyze_all(filename, sample_size=10000, top_n=20)
     except Exception as e:
-        print(f"Error getting date range: {e}")
+        print(f"Error analyzing posts: {e}")
     
     print("\n" + "=" * 50)
     print("Analysis complete!")
@@ -3,6 +3,8 @@ Configuration file for Danbooru scraper.
 Modify these settings according to your needs.
 """
 
+import struct
+
 # API Configuration
 API_BASE_URL = "https://danbooru.donmai.us"
 
@@ -10,9 +12,10 @@ API_BASE_URL = "https://danbooru.donmai.us"
 POSTS_PER_PAGE = 200  # Maximum allowed by Danbooru API
 DELAY_BETWEEN_REQUESTS = 1.0  # Seconds to wait between API requests (be respectful!)
 BATCH_SIZE = 1000  # Number of IDs to process in each batch
+CONCURRENT_BATCHES = 4  # Number of ID batches scraped at the same time (share the request delay)
 
 # File Configuration
-OUTPUT_FILE = "danbooru_posts.jsonl"  # Output file in JSON Lines format
+OUTPUT_FILE = "danbooru_posts.jsonl"  # Output file in JSON Lines format (use a .zst suffix to compress)
 STATE_FILE = "scraper_state.json"  # State file for resume capability
 LOG_FILE = "scraper.log"  # Log file for detailed logging
 
@@ -25,3 +28,8 @@ DANBOORU_API_KEY = None  # Set to your API key or None
 REQUEST_TIMEOUT = 30  # Timeout for API requests in seconds
 MAX_RETRIES = 3  # Number of retries for failed requests
 RETRY_DELAY = 5  # Seconds to wait before retrying a failed request
+
+# ID index file format, shared by scraper.py and analyze_posts.py (don't change)
+# Each entry is a post ID and the byte offset of its line (little-endian uint64s)
+INDEX_ENTRY = struct.Struct('<QQ')
+INDEX_ID = struct.Struct('<Q')  # Just the post ID at the start of an entry
@@ -3,14 +3,38 @@ Danbooru API Scraper
 Scrapes all posts from Danbooru API with resume capability and memory-efficient streaming.
 """
 
-import requests
-import json
-import time
+import asyncio
+import aiohttp
+import heapq
+import itertools
+import orjson
 import os
+import tempfile
+import time
+import zstandard as zstd
+from aiolimiter import AsyncLimiter
 from datetime import datetime
-from typing import Optional, Dict, Any
+from operator import itemgetter
+from typing import Optional, Dict, Any, Mapping, Tuple
 import logging
 
+from config import INDEX_ENTRY
+
+# HTTP statuses worth retrying (rate limited or transient server errors)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+INDEX_SORT_RUN = 1 << 20  # ID index entries sorted in memory at a time
+
+
+def _iter_index_entries(f, chunk_entries: int = 1 << 16):
+    """Iterate over the (post_id, offset) entries of an open index file."""
+    while True:
+        chunk = f.read(chunk_entries * INDEX_ENTRY.size)
+        if not chunk:
+            break
+        yield from INDEX_ENTRY.iter_unpack(chunk[:len(chunk) - len(chunk) % INDEX_ENTRY.size])
+
+
 class DanbooruScraper:
     def __init__(self, 
                  output_file: str = "danbooru_posts.jsonl",
@@ -18,17 +42,26 @@ class DanbooruScraper:
                  api_base_url: str = "https://danbooru.donmai.us",
                  posts_per_page: int = 200,
                  delay_between_requests: float = 1.0,
-                 batch_size: int = 1000):
+                 batch_size: int = 1000,
+                 concurrency: int = 4,
+                 max_retries: int = 3,
+                 retry_delay: float = 5.0):
         """
         Initialize the Danbooru scraper.
         
         Args:
-            output_file: Path to output JSONL file (streaming)
+            output_file: Path to output JSONL file (streaming); a `.zst` suffix
+                writes zstd-compressed JSONL. Uncompressed output also gets a
+                sorted ID index (`.idx`) for fast lookups by post ID
             state_file: Path to state file for resume capability
             api_base_url: Base URL for Danbooru API
             posts_per_page: Number of posts to fetch per API call (max 200)
             delay_between_requests: Delay in seconds between API requests
+                (applies across all concurrent batches)
             batch_size: ID range batch size for scanning
+            concurrency: Number of ID range batches scraped concurrently
+            max_retries: Number of retries for failed requests
+            retry_delay: Base delay in seconds before retrying (doubles per attempt)
         """
         self.output_file = output_file
         self.state_file = state_file
@@ -36,6 +69,18 @@ class DanbooruScraper:
         self.posts_per_page = min(posts_per_page, 200)  # Danbooru max is 200
         self.delay = delay_between_requests
         self.batch_size = batch_size
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        
+        # HTTP session and rate limiter, created per scraping session
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.limiter: Optional[AsyncLimiter] = None
+        
+        # State saves are debounced: at most one per interval unless forced
+        self._save_interval = 5.0
+        self._last_save_mono = 0.0
+        self._last_saved_progress: Optional[Dict[str, Any]] = None
         
         # Setup logging
         logging.basicConfig(
@@ -51,12 +96,148 @@ class DanbooruScraper:
         # Load or initialize state
         self.state = self._load_state()
         
+        # Batches finished ahead of `current_batch_start` (start -> end ID)
+        self._finished_batches: Dict[int, int] = {
+            start: end for start, end in self.state.get('finished_batches', [])
+        }
+        
+        # Output stays open for the whole session; flushed whenever state is saved
+        self.compress = output_file.endswith('.zst')
+        self.index_file = None if self.compress else os.path.splitext(output_file)[0] + '.idx'
+        self._truncate_unsaved_output()
+        self._index_existing_output()
+        if self.compress:
+            self._out_raw = open(self.output_file, 'ab')
+            self.out_fh = zstd.ZstdCompressor(level=3, threads=-1).stream_writer(self._out_raw)
+            self._frame_open = False
+            self.idx_fh = None
+        else:
+            self.out_fh = open(self.output_file, 'ab', buffering=1 << 20)
+            self.idx_fh = open(self.index_file, 'ab')
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def close(self):
+        """Flush and close the output file, then sort the ID index."""
+        if self.compress:
+            if not self._out_raw.closed:
+                # Closing the writer would append an empty frame that the saved
+                # output_size doesn't cover, so only end a frame with posts in it
+                self._flush_output()
+                self._out_raw.close()
+        elif not self.out_fh.closed:
+            self.out_fh.close()
+        if self.idx_fh is not None and not self.idx_fh.closed:
+            self.idx_fh.close()
+            if not self.state.get('index_sorted', True):
+                # Drop unsaved entries first; once sorted they can't be cut off the end
+                self._truncate_unsaved_output()
+                self._sort_index()
+    
+    def _sort_index(self):
+        """
+        Sort the ID index by post ID so lookups can binary search it.
+        Sorts runs of INDEX_SORT_RUN entries in memory, then merges them,
+        so memory use stays bounded however large the index grows.
+        """
+        try:
+            runs = []
+            with open(self.index_file, 'rb') as f:
+                unsorted = _iter_index_entries(f)
+                while True:
+                    entries = list(itertools.islice(unsorted, INDEX_SORT_RUN))
+                    if not entries:
+                        break
+                    entries.sort()
+                    run = tempfile.TemporaryFile()
+                    run.write(b''.join(INDEX_ENTRY.pack(*entry) for entry in entries))
+                    run.seek(0)
+                    runs.append(run)
+            
+            tmp_file = self.index_file + '.tmp'
+            with open(tmp_file, 'wb') as out:
+                merged = heapq.merge(*[_iter_index_entries(run) for run in runs])
+                for batch in iter(lambda: list(itertools.islice(merged, 1 << 16)), []):
+                    out.write(b''.join(INDEX_ENTRY.pack(*entry) for entry in batch))
+            for run in runs:
+                run.close()
+            os.replace(tmp_file, self.index_file)
+            self.state['index_sorted'] = True
+            self._write_state()
+        except Exception as e:
+            self.logger.error(f"Error sorting index file: {e}")
+    
+    def _truncate_unsaved_output(self):
+        """
+        Drop output (and index entries) written after the last saved state. An
+        interrupted run can leave a partial line (or an unfinished zstd frame)
+        that later appends would otherwise be glued onto.
+        """
+        for path, size_key in ((self.output_file, 'output_size'), (self.index_file, 'index_size')):
+            saved_size = self.state.get(size_key)
+            if saved_size is None or path is None or not os.path.exists(path):
+                continue
+            if os.path.getsize(path) > saved_size:
+                self.logger.warning(f"Discarding data written to {path} after the last saved state")
+                with open(path, 'r+b') as f:
+                    f.truncate(saved_size)
+    
+    def _index_existing_output(self):
+        """
+        Build the ID index for output written before the index existed, so
+        lookups can trust it to cover the whole file. Runs once, on the first
+        start with an uncompressed output file but no index.
+        """
+        if self.index_file is None or not os.path.exists(self.output_file):
+            return
+        if os.path.exists(self.index_file) and os.path.getsize(self.index_file) > 0:
+            return
+        if os.path.getsize(self.output_file) == 0:
+            return
+        
+        self.logger.info(f"Building ID index for existing posts in {self.output_file}")
+        try:
+            tmp_file = self.index_file + '.tmp'
+            with open(self.output_file, 'rb') as f, open(tmp_file, 'wb') as idx:
+                offset = 0
+                entries = []
+                for line in f:
+                    try:
+                        entries.append(INDEX_ENTRY.pack(orjson.loads(line)['id'], offset))
+                    except Exception as e:
+                        self.logger.warning(f"Skipping unreadable line at offset {offset}: {e}")
+                    offset += len(line)
+                    if len(entries) >= 1 << 16:
+                        idx.write(b''.join(entries))
+                        entries = []
+                idx.write(b''.join(entries))
+            os.replace(tmp_file, self.index_file)
+            self.state['index_sorted'] = False
+            self.state['index_size'] = os.path.getsize(self.index_file)
+            self._write_state()
+        except Exception as e:
+            self.logger.error(f"Error building index file: {e}")
+    
+    def _flush_output(self):
+        """Write buffered posts to disk; compressed output ends the current zstd frame."""
+        if self.compress:
+            if self._frame_open:
+                self.out_fh.flush(zstd.FLUSH_FRAME)
+                self._frame_open = False
+        else:
+            self.out_fh.flush()
+            self.idx_fh.flush()
+        
     def _load_state(self) -> Dict[str, Any]:
         """Load scraper state from file or create new state."""
         if os.path.exists(self.state_file):
             try:
-                with open(self.state_file, 'r') as f:
-                    state = json.load(f)
+                with open(self.state_file, 'rb') as f:
+                    state = orjson.loads(f.read())
                     self.logger.info(f"Resuming from last saved state: {state}")
                     return state
             except Exception as e:
@@ -67,37 +248,113 @@ class DanbooruScraper:
             'last_processed_id': 0,
             'total_posts_scraped': 0,
             'last_update': None,
-            'current_batch_start': 1
+            'current_batch_start': 1,
+            'finished_batches': []
         }
     
-    def _save_state(self):
-        """Save current scraper state to file."""
+    def _save_state(self, force: bool = False):
+        """
+        Save current scraper state to file.
+        Saves are skipped if the last one was under `_save_interval` seconds ago
+        (unless `force` is set) or if no progress was made since.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_save_mono < self._save_interval:
+            return
+        progress = {
+            k: v for k, v in self.state.items()
+            if k not in ('last_update', 'output_size', 'index_size')
+        }
+        if progress == self._last_saved_progress:
+            return
+        
         self.state['last_update'] = datetime.now().isoformat()
         try:
-            with open(self.state_file, 'w') as f:
-                json.dump(self.state, f, indent=2)
+            # Posts counted in the state must be on disk before the state is
+            self._flush_output()
+            self.state['output_size'] = os.path.getsize(self.output_file)
+            if self.index_file is not None:
+                self.state['index_size'] = os.path.getsize(self.index_file)
+            
+            self._write_state()
+            
+            self._last_save_mono = now
+            self._last_saved_progress = progress
         except Exception as e:
             self.logger.error(f"Error saving state: {e}")
     
-    def _get_highest_post_id(self) -> Optional[int]:
-        """Get the highest post ID available on Danbooru."""
+    def _write_state(self):
+        """Write the state to a temp file and rename it so the state file is never half-written."""
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(orjson.dumps(self.state, option=orjson.OPT_INDENT_2))
+        os.replace(tmp_file, self.state_file)
+    
+    async def _get(self,
+                   url: str,
+                   params: Dict[str, Any],
+                   headers: Optional[Dict[str, str]] = None) -> Tuple[int, Mapping[str, str], bytes]:
+        """
+        GET a URL over the shared keep-alive session.
+        Rate-limit, server and connection errors are retried with exponential backoff.
+        
+        Returns:
+            Tuple of (status, response headers, body)
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                # Rate limiting - shared by all concurrent batches
+                async with self.limiter:
+                    async with self.session.get(url, params=params, headers=headers) as response:
+                        if response.status not in RETRY_STATUSES or attempt == self.max_retries:
+                            response.raise_for_status()
+                            return response.status, response.headers, await response.read()
+                        reason = f"HTTP {response.status}"
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    raise
+                reason = str(e) or type(e).__name__
+            
+            wait = self.retry_delay * 2 ** attempt
+            self.logger.warning(f"Request failed ({reason}), retrying in {wait}s")
+            await asyncio.sleep(wait)
+    
+    async def _get_json(self, url: str, params: Dict[str, Any]) -> Any:
+        """GET and decode a JSON document (see `_get`)."""
+        _, _, body = await self._get(url, params)
+        return orjson.loads(body)
+    
+    async def _get_highest_post_id(self) -> Optional[int]:
+        """
+        Get the highest post ID available on Danbooru.
+        Sends the ETag of the last answer so an unchanged result comes back as
+        an empty 304 Not Modified.
+        """
         try:
             url = f"{self.api_base_url}/posts.json"
             params = {'limit': 1, 'page': 1}
-            response = requests.get(url, params=params, timeout=30)
-            response.raise_for_status()
+            etag = self.state.get('highest_id_etag')
+            cached_id = self.state.get('highest_id')
+            headers = {'If-None-Match': etag} if etag and cached_id else None
+            
+            status, response_headers, body = await self._get(url, params, headers)
+            if status == 304:
+                self.logger.info(f"Highest post ID unchanged: {cached_id}")
+                return cached_id
             
-            posts = response.json()
+            posts = orjson.loads(body)
             if posts and len(posts) > 0:
                 highest_id = posts[0]['id']
                 self.logger.info(f"Highest post ID found: {highest_id}")
+                self.state['highest_id'] = highest_id
+                self.state['highest_id_etag'] = response_headers.get('ETag')
                 return highest_id
             return None
         except Exception as e:
             self.logger.error(f"Error getting highest post ID: {e}")
             return None
     
-    def _fetch_posts_by_id_range(self, min_id: int, max_id: int, page: int = 1) -> list:
+    async def _fetch_posts_by_id_range(self, min_id: int, max_id: int, page: int = 1) -> list:
         """
         Fetch posts within a specific ID range.
         
@@ -119,17 +376,15 @@ class DanbooruScraper:
             }
             
             self.logger.info(f"Fetching: ID range {min_id}-{max_id}, page {page}")
-            response = requests.get(url, params=params, timeout=30)
-            response.raise_for_status()
+            posts = await self._get_json(url, params)
             
-            posts = response.json()
             self.logger.info(f"Retrieved {len(posts)} posts")
             return posts
             
-        except requests.exceptions.RequestException as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             self.logger.error(f"Request error: {e}")
             return []
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             self.logger.error(f"JSON decode error: {e}")
             return []
         except Exception as e:
@@ -142,14 +397,25 @@ class DanbooruScraper:
         This ensures we never load all data into memory.
         """
         try:
-            with open(self.output_file, 'a', encoding='utf-8') as f:
-                for post in posts:
-                    json_line = json.dumps(post, ensure_ascii=False)
-                    f.write(json_line + '\n')
+            lines = [orjson.dumps(post) + b'\n' for post in posts]
+            
+            if self.idx_fh is not None:
+                # Record where each post's line starts for the ID index
+                offset = self.out_fh.tell()
+                entries = []
+                for post, line in zip(posts, lines):
+                    entries.append(INDEX_ENTRY.pack(post['id'], offset))
+                    offset += len(line)
+                self.out_fh.write(b''.join(lines))
+                self.idx_fh.write(b''.join(entries))
+                self.state['index_sorted'] = False
+            else:
+                self.out_fh.write(b''.join(lines))
+                self._frame_open = True
         except Exception as e:
             self.logger.error(f"Error writing to output file: {e}")
     
-    def _scrape_id_range(self, min_id: int, max_id: int) -> int:
+    async def _scrape_id_range(self, min_id: int, max_id: int) -> int:
         """
         Scrape all posts within an ID range.
         
@@ -166,7 +432,7 @@ class DanbooruScraper:
         
         while page <= max_pages:
             # Fetch posts for current page
-            posts = self._fetch_posts_by_id_range(min_id, max_id, page)
+            posts = await self._fetch_posts_by_id_range(min_id, max_id, page)
             
             if not posts:
                 # No more posts in this range
@@ -179,12 +445,16 @@ class DanbooruScraper:
             posts_scraped += len(posts)
             self.state['total_posts_scraped'] += len(posts)
             
-            # Update last processed ID
-            max_post_id = max(post['id'] for post in posts)
+            # Update last processed ID; Danbooru returns posts newest (highest ID) first
+            if posts[0]['id'] >= posts[-1]['id']:
+                max_post_id = posts[0]['id']
+            else:
+                self.logger.warning(f"Posts in range {min_id}-{max_id} page {page} not sorted by ID descending")
+                max_post_id = max(map(itemgetter('id'), posts))
             if max_post_id > self.state['last_processed_id']:
                 self.state['last_processed_id'] = max_post_id
             
-            # Save state periodically
+            # Save state periodically (debounced)
             self._save_state()
             
             self.logger.info(
@@ -198,52 +468,81 @@ class DanbooruScraper:
                 break
             
             page += 1
-            
-            # Rate limiting - wait between requests
-            time.sleep(self.delay)
         
         return posts_scraped
     
-    def scrape_all(self):
+    async def _scrape_batch(self, min_id: int, max_id: int, semaphore: asyncio.Semaphore):
+        """Scrape one ID range batch once a concurrency slot is free."""
+        async with semaphore:
+            self.logger.info(f"\n{'='*50}")
+            self.logger.info(f"Processing batch: IDs {min_id} to {max_id}")
+            self.logger.info(f"{'='*50}")
+            
+            # Scrape this ID range
+            batch_posts = await self._scrape_id_range(min_id, max_id)
+            
+            self.logger.info(f"Batch complete: {batch_posts} posts scraped (IDs {min_id} to {max_id})")
+            
+            # Move the resume point past every contiguous finished batch;
+            # batches can finish out of order
+            self._finished_batches[min_id] = max_id
+            while self.state['current_batch_start'] in self._finished_batches:
+                finished_max_id = self._finished_batches.pop(self.state['current_batch_start'])
+                self.state['current_batch_start'] = finished_max_id + 1
+            self.state['finished_batches'] = sorted(
+                [start, end] for start, end in self._finished_batches.items()
+            )
+            self._save_state(force=True)
+    
+    async def scrape_all(self):
         """
         Main method to scrape all posts from Danbooru.
-        Uses ID-based batching to work around the 1000-page limit.
+        Uses ID-based batching to work around the 1000-page limit and
+        scrapes up to `concurrency` batches at a time.
         """
         self.logger.info("=" * 50)
         self.logger.info("Starting Danbooru scraping session")
         self.logger.info("=" * 50)
         
-        # Get the highest post ID to know our target
-        highest_id = self._get_highest_post_id()
-        if highest_id is None:
-            self.logger.error("Could not determine highest post ID. Aborting.")
-            return
-        
-        self.logger.info(f"Target highest ID: {highest_id}")
-        
-        # Start from where we left off
-        current_min_id = self.state.get('current_batch_start', 1)
+        # AsyncLimiter needs a non-zero time period
+        self.limiter = AsyncLimiter(1, max(self.delay, 0.001))
+        connector = aiohttp.TCPConnector(limit=8)
+        timeout = aiohttp.ClientTimeout(total=30)
         
-        # Process in batches
-        while current_min_id <= highest_id:
-            current_max_id = min(current_min_id + self.batch_size - 1, highest_id)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            self.session = session
             
-            self.logger.info(f"\n{'='*50}")
-            self.logger.info(f"Processing batch: IDs {current_min_id} to {current_max_id}")
-            self.logger.info(f"{'='*50}")
+            # Get the highest post ID to know our target
+            highest_id = await self._get_highest_post_id()
+            if highest_id is None:
+                self.logger.error("Could not determine highest post ID. Aborting.")
+                return
             
-            # Scrape this ID range
-            batch_posts = self._scrape_id_range(current_min_id, current_max_id)
-            
-            self.logger.info(f"Batch complete: {batch_posts} posts scraped")
+            self.logger.info(f"Target highest ID: {highest_id}")
             
-            # Move to next batch
-            current_min_id = current_max_id + 1
-            self.state['current_batch_start'] = current_min_id
-            self._save_state()
+            # Start from where we left off
+            self.state.setdefault('current_batch_start', 1)
+            current_min_id = self.state['current_batch_start']
             
-            # Brief pause between batches
-            time.sleep(self.delay)
+            # Process in batches, skipping those already finished in an earlier run
+            batches = []
+            min_id = current_min_id
+            while min_id <= highest_id:
+                if min_id in self._finished_batches:
+                    min_id = self._finished_batches[min_id] + 1
+                    continue
+                max_id = min(min_id + self.batch_size - 1, highest_id)
+                batches.append((min_id, max_id))
+                min_id = max_id + 1
+            semaphore = asyncio.Semaphore(self.concurrency)
+            try:
+                await asyncio.gather(*[
+                    self._scrape_batch(min_id, max_id, semaphore)
+                    for min_id, max_id in batches
+                ])
+            finally:
+                # Also runs when interrupted (Ctrl+C cancels the gather)
+                self._save_state(force=True)
         
         self.logger.info("\n" + "=" * 50)
         self.logger.info("SCRAPING COMPLETE!")
@@ -261,6 +560,8 @@ class DanbooruScraper:
             'output_file_size_mb': 0
         }
         
+        if not self.out_fh.closed:
+            self._flush_output()
         if os.path.exists(self.output_file):
             stats['output_file_size_mb'] = os.path.getsize(self.output_file) / (1024 * 1024)
         
@@ -270,33 +571,35 @@ class DanbooruScraper:
 def main():
     """Main entry point for the scraper."""
     # Configuration
-    scraper = DanbooruScraper(
+    with DanbooruScraper(
         output_file="danbooru_posts.jsonl",
         state_file="scraper_state.json",
         api_base_url="https://danbooru.donmai.us",
         posts_per_page=200,  # Max allowed by Danbooru
         delay_between_requests=1.0,  # 1 second between requests (be respectful)
-        batch_size=1000  # Process 1000 IDs at a time
-    )
-    
-    # Start scraping
-    try:
-        scraper.scrape_all()
-        
-        # Print final statistics
-        stats = scraper.get_statistics()
-        print("\n" + "=" * 50)
-        print("FINAL STATISTICS")
-        print("=" * 50)
-        for key, value in stats.items():
-            print(f"{key}: {value}")
+        batch_size=1000,  # Process 1000 IDs at a time
+        concurrency=4,  # Scrape 4 batches at a time, sharing the request delay
+        max_retries=3,  # Retry rate-limited and failed requests
+        retry_delay=5.0  # 5s, 10s, 20s backoff between retries
+    ) as scraper:
+        # Start scraping
+        try:
+            asyncio.run(scraper.scrape_all())
+            
+            # Print final statistics
+            stats = scraper.get_statistics()
+            print("\n" + "=" * 50)
+            print("FINAL STATISTICS")
+            print("=" * 50)
+            for key, value in stats.items():
+                print(f"{key}: {value}")
         
-    except KeyboardInterrupt:
-        print("\n\nScraping interrupted by user.")
-        print("Progress has been saved. Run again to resume.")
-    except Exception as e:
-        print(f"\n\nUnexpected error: {e}")
-        print("Progress has been saved. Run again to resume.")
+        except KeyboardInterrupt:
+            print("\n\nScraping interrupted by user.")
+            print("Progress has been saved. Run again to resume.")
+        except Exception as e:
+            print(f"\n\nUnexpected error: {e}")
+            print("Progress has been saved. Run again to resume.")
 
 
 if __name__ == "__main__":
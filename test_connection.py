@@ -3,93 +3,88 @@ Test script to verify Danbooru API connectivity and basic functionality.
 Run this before starting the full scraper to ensure everything works.
 """
 
-import requests
-import json
+import aiohttp
+import asyncio
 import sys
 
+API_URL = "https://danbooru.donmai.us/posts.json"
 
-def test_api_connection():
+async def fetch_posts(session, params):
+    """Fetch a page of posts from the API."""
+    async with session.get(API_URL, params=params) as response:
+        response.raise_for_status()
+        return await response.json()
+
+
+# Each test returns (passed, output lines) so concurrent tests don't interleave their output
+
+
+async def test_api_connection(latest_posts):
     """Test basic API connectivity."""
-    print("Testing Danbooru API connection...")
+    lines = ["Testing Danbooru API connection..."]
     
     try:
-        url = "https://danbooru.donmai.us/posts.json"
-        params = {'limit': 1}
-        
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        
-        posts = response.json()
+        posts = await latest_posts
         
         if posts and len(posts) > 0:
-            print("✓ API connection successful!")
-            print(f"  Latest post ID: {posts[0]['id']}")
-            return True
+            lines.append("✓ API connection successful!")
+            lines.append(f"  Latest post ID: {posts[0]['id']}")
+            return True, lines
         else:
-            print("✗ API returned no posts")
-            return False
+            lines.append("✗ API returned no posts")
+            return False, lines
             
-    except requests.exceptions.ConnectionError:
-        print("✗ Connection error - check your internet connection")
-        return False
-    except requests.exceptions.Timeout:
-        print("✗ Request timed out - server may be slow")
-        return False
-    except requests.exceptions.HTTPError as e:
-        print(f"✗ HTTP error: {e}")
-        return False
+    except asyncio.TimeoutError:
+        lines.append("✗ Request timed out - server may be slow")
+        return False, lines
+    except aiohttp.ClientConnectionError:
+        lines.append("✗ Connection error - check your internet connection")
+        return False, lines
+    except aiohttp.ClientResponseError as e:
+        lines.append(f"✗ HTTP error: {e}")
+        return False, lines
     except Exception as e:
-        print(f"✗ Unexpected error: {e}")
-        return False
+        lines.append(f"✗ Unexpected error: {e}")
+        return False, lines
 
 
-def test_id_range_query():
+async def test_id_range_query(session):
     """Test ID range query functionality."""
-    print("\nTesting ID range query...")
+    lines = ["\nTesting ID range query..."]
     
     try:
-        url = "https://danbooru.donmai.us/posts.json"
         params = {
             'tags': 'id:1..100',
             'limit': 10
         }
         
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        
-        posts = response.json()
+        posts = await fetch_posts(session, params)
         
         if posts:
-            print(f"✓ ID range query successful!")
-            print(f"  Retrieved {len(posts)} posts")
-            print(f"  Post IDs: {[p['id'] for p in posts[:5]]}")
-            return True
+            lines.append(f"✓ ID range query successful!")
+            lines.append(f"  Retrieved {len(posts)} posts")
+            lines.append(f"  Post IDs: {[p['id'] for p in posts[:5]]}")
+            return True, lines
         else:
-            print("✗ No posts returned for ID range query")
-            return False
+            lines.append("✗ No posts returned for ID range query")
+            return False, lines
             
     except Exception as e:
-        print(f"✗ Error: {e}")
-        return False
+        lines.append(f"✗ Error: {e}")
+        return False, lines
 
 
-def test_post_structure():
+async def test_post_structure(latest_posts):
     """Test and display post data structure."""
-    print("\nTesting post data structure...")
+    lines = ["\nTesting post data structure..."]
     
     try:
-        url = "https://danbooru.donmai.us/posts.json"
-        params = {'limit': 1}
-        
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        
-        posts = response.json()
+        posts = await latest_posts
         
         if posts and len(posts) > 0:
             post = posts[0]
-            print("✓ Sample post retrieved!")
-            print(f"\n  Available fields ({len(post.keys())} total):")
+            lines.append("✓ Sample post retrieved!")
+            lines.append(f"\n  Available fields ({len(post.keys())} total):")
             
             # Display key fields
             important_fields = [
@@ -104,42 +99,34 @@ def test_post_structure():
                     value = post[field]
                     if isinstance(value, str) and len(value) > 50:
                         value = value[:50] + "..."
-                    print(f"    - {field}: {value}")
-            
-            print(f"\n  All fields: {', '.join(sorted(post.keys()))}")
-            return True
+                    lines.append(f"    - {field}: {value}")
+                    
+            lines.append(f"\n  All fields: {', '.join(sorted(post.keys()))}")
+            return True, lines
         else:
-            print("✗ No posts returned")
-            return False
+            lines.append("✗ No posts returned")
+            return False, lines
             
     except Exception as e:
-        print(f"✗ Error: {e}")
-        return False
+        lines.append(f"✗ Error: {e}")
+        return False, lines
 
 
-def test_pagination():
+async def test_pagination(session):
     """Test pagination functionality."""
-    print("\nTesting pagination...")
+    lines = ["\nTesting pagination..."]
     
     try:
-        url = "https://danbooru.donmai.us/posts.json"
-        
-        # Fetch page 1
-        params = {'limit': 5, 'page': 1}
-        response1 = requests.get(url, params=params, timeout=10)
-        response1.raise_for_status()
-        posts1 = response1.json()
-        
-        # Fetch page 2
-        params = {'limit': 5, 'page': 2}
-        response2 = requests.get(url, params=params, timeout=10)
-        response2.raise_for_status()
-        posts2 = response2.json()
+        # Fetch pages 1 and 2 concurrently
+        posts1, posts2 = await asyncio.gather(
+            fetch_posts(session, {'limit': 5, 'page': 1}),
+            fetch_posts(session, {'limit': 5, 'page': 2}),
+        )
         
         if posts1 and posts2:
-            print(f"✓ Pagination working!")
-            print(f"  Page 1: {len(posts1)} posts, IDs: {[p['id'] for p in posts1]}")
-            print(f"  Page 2: {len(posts2)} posts, IDs: {[p['id'] for p in posts2]}")
+            lines.append(f"✓ Pagination working!")
+            lines.append(f"  Page 1: {len(posts1)} posts, IDs: {[p['id'] for p in posts1]}")
+            lines.append(f"  Page 2: {len(posts2)} posts, IDs: {[p['id'] for p in posts2]}")
             
             # Check for overlap (there shouldn't be any)
             ids1 = set(p['id'] for p in posts1)
@@ -147,52 +134,64 @@ def test_pagination():
             overlap = ids1 & ids2
             
             if overlap:
-                print(f"  ⚠ Warning: Found overlapping IDs: {overlap}")
+                lines.append(f"  ⚠ Warning: Found overlapping IDs: {overlap}")
             else:
-                print(f"  ✓ No overlap between pages")
-            
-            return True
+                lines.append(f"  ✓ No overlap between pages")
+                
+            return True, lines
         else:
-            print("✗ Pagination test failed")
-            return False
+            lines.append("✗ Pagination test failed")
+            return False, lines
             
     except Exception as e:
-        print(f"✗ Error: {e}")
-        return False
+        lines.append(f"✗ Error: {e}")
+        return False, lines
 
 
-def estimate_total_posts():
+async def estimate_total_posts(latest_posts):
     """Estimate total number of posts available."""
-    print("\nEstimating total posts...")
+    lines = ["\nEstimating total posts..."]
     
     try:
-        url = "https://danbooru.donmai.us/posts.json"
-        params = {'limit': 1, 'page': 1}
-        
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        
-        posts = response.json()
+        posts = await latest_posts
         
         if posts:
             highest_id = posts[0]['id']
-            print(f"✓ Highest post ID: {highest_id:,}")
-            print(f"  Estimated scraping time (at 200 posts/sec with 1s delay):")
+            lines.append(f"✓ Highest post ID: {highest_id:,}")
+            lines.append(f"  Estimated scraping time (at 200 posts/sec with 1s delay):")
             
             hours = (highest_id / 200) / 3600
             days = hours / 24
             
-            print(f"    ~{hours:.1f} hours ({days:.1f} days)")
-            print(f"  Estimated file size (rough): {(highest_id * 2) / 1024:.1f} MB")
+            lines.append(f"    ~{hours:.1f} hours ({days:.1f} days)")
+            lines.append(f"  Estimated file size (rough): {(highest_id * 2) / 1024:.1f} MB")
             
-            return True
+            return True, lines
         else:
-            print("✗ Could not estimate")
-            return False
+            lines.append("✗ Could not estimate")
+            return False, lines
             
     except Exception as e:
-        print(f"✗ Error: {e}")
-        return False
+        lines.append(f"✗ Error: {e}")
+        return False, lines
+
+
+async def run_tests():
+    """Run all tests concurrently over one session; returns (test name, outcome) pairs."""
+    timeout = aiohttp.ClientTimeout(total=10)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        # One `limit=1` request, shared by every test that needs the latest post
+        latest_posts = asyncio.ensure_future(fetch_posts(session, {'limit': 1}))
+        
+        tests = [
+            ("API Connection", test_api_connection(latest_posts)),
+            ("ID Range Query", test_id_range_query(session)),
+            ("Post Structure", test_post_structure(latest_posts)),
+            ("Pagination", test_pagination(session)),
+            ("Total Posts Estimate", estimate_total_posts(latest_posts)),
+        ]
+        outcomes = await asyncio.gather(*[test for _, test in tests], return_exceptions=True)
+        return [(test_name, outcome) for (test_name, _), outcome in zip(tests, outcomes)]
 
 
 def main():
@@ -201,24 +200,17 @@ def main():
     print("Danbooru API Scraper - Connection Test")
     print("=" * 60)
     
-    tests = [
-        ("API Connection", test_api_connection),
-        ("ID Range Query", test_id_range_query),
-        ("Post Structure", test_post_structure),
-        ("Pagination", test_pagination),
-        ("Total Posts Estimate", estimate_total_posts),
-    ]
-    
     results = []
     
-    for test_name, test_func in tests:
-        try:
-            result = test_func()
-            results.append((test_name, result))
-        except Exception as e:
-            print(f"✗ Test '{test_name}' crashed: {e}")
+    for test_name, outcome in asyncio.run(run_tests()):
+        if isinstance(outcome, Exception):
+            print(f"✗ Test '{test_name}' crashed: {outcome}")
             results.append((test_name, False))
-    
+        else:
+            result, lines = outcome
+            print("\n".join(lines))
+            results.append((test_name, result))
+            
     # Summary
     print("\n" + "=" * 60)
     print("Test Summary")
@@ -230,7 +222,7 @@ def main():
     for test_name, result in results:
         status = "✓ PASS" if result else "✗ FAIL"
         print(f"{status}: {test_name}")
-    
+        
     print(f"\nTotal: {passed}/{total} tests passed")
     
     if passed == total: